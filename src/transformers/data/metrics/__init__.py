@@ -14,15 +14,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# only the top-level packages are imported here so that a broken install is caught;
+# sklearn.metrics, scipy.stats and numba are imported by the helpers that need them
 try:
-    from scipy.stats import pearsonr, spearmanr
     import numpy as np
-    from sklearn.metrics import matthews_corrcoef, precision_score, recall_score, f1_score, roc_auc_score, average_precision_score
+    import sklearn  # noqa: F401
 
     _has_sklearn = True
 except (AttributeError, ImportError):
     _has_sklearn = False
 
+# the numba kernel costs a couple of seconds of JIT per process and only beats the NumPy
+# bincount once its (N, L) temporaries get large, so it is reserved for very wide inputs
+_NUMBA_MIN_CELLS = 10 ** 7
+
 
 def is_sklearn_available():
     return _has_sklearn
@@ -30,10 +41,23 @@ def is_sklearn_available():
 
 if _has_sklearn:
 
+    def _is_empty(preds):
+        # e.g. the last, partial batch of a distributed eval; sklearn scorers raise on it
+        return getattr(preds, "size", len(preds)) == 0
+
     def simple_accuracy(preds, labels):
+        if _is_empty(preds):
+            return 0.0
+        if isinstance(preds, np.ndarray):
+            eq = preds == labels
+            return np.count_nonzero(eq) / eq.size
         return (preds == labels).mean()
 
     def acc_and_f1(preds, labels):
+        from sklearn.metrics import f1_score
+
+        if _is_empty(preds):
+            return {k: 0.0 for k in ("acc", "f1", "acc_and_f1")}
         acc = simple_accuracy(preds, labels)
         f1 = f1_score(y_true=labels, y_pred=preds)
         return {
@@ -43,6 +67,10 @@ if _has_sklearn:
         }
     
     def acc_f1_mcc(preds, labels):
+        from sklearn.metrics import f1_score, matthews_corrcoef
+
+        if _is_empty(preds):
+            return {k: 0.0 for k in ("acc", "f1", "mcc")}
         acc = simple_accuracy(preds, labels)
         f1 = f1_score(y_true=labels, y_pred=preds)
         mcc = matthews_corrcoef(labels, preds)
@@ -52,41 +80,74 @@ if _has_sklearn:
             "mcc": mcc
         }
 
-    def acc_f1_mcc_auc_aupr_pre_rec(preds, labels, probs):
-        acc = simple_accuracy(preds, labels)
-        precision = precision_score(y_true=labels, y_pred=preds)
-        recall = recall_score(y_true=labels, y_pred=preds)
-        f1 = f1_score(y_true=labels, y_pred=preds)
-        mcc = matthews_corrcoef(labels, preds)
-        auc = roc_auc_score(labels, probs)
-        aupr = average_precision_score(labels, probs)
-        return {
+    def _binary_confusion(y, p):
+        tp = int(((y == 1) & (p == 1)).sum())
+        fp = int(((y == 0) & (p == 1)).sum())
+        fn = int(((y == 1) & (p == 0)).sum())
+        tn = int(((y == 0) & (p == 0)).sum())
+        return tp, fp, fn, tn
+
+    def _multiclass_or_binary_metrics(preds, labels, probs, average, include_aupr):
+        from sklearn.metrics import (
+            average_precision_score,
+            f1_score,
+            matthews_corrcoef,
+            precision_score,
+            recall_score,
+            roc_auc_score,
+        )
+
+        if _is_empty(preds):
+            keys = ["acc", "f1", "mcc", "auc", "precision", "recall"]
+            if include_aupr:
+                keys.insert(4, "aupr")
+            return {k: 0.0 for k in keys}
+        preds = np.asarray(preds)
+        labels = np.asarray(labels)
+        probs = np.asarray(probs)
+        if average == "binary":
+            # derive acc/precision/recall/f1 from one set of counts, matching sklearn's zero-division results of 0.0;
+            # auc/aupr/mcc are undefined when a class is absent and are reported as 0.0 without calling sklearn
+            tp, fp, fn, tn = _binary_confusion(labels, preds)
+            acc = (tp + tn) / len(labels)
+            precision = tp / (tp + fp) if tp + fp else 0.0
+            recall = tp / (tp + fn) if tp + fn else 0.0
+            f1 = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0
+            auc = roc_auc_score(labels, probs) if tp + fn and fp + tn else 0.0
+            mcc = matthews_corrcoef(labels, preds) if (tp + fn) * (fp + tn) * (tp + fp) * (fn + tn) else 0.0
+        else:
+            acc = simple_accuracy(preds, labels)
+            precision = precision_score(y_true=labels, y_pred=preds, average=average)
+            recall = recall_score(y_true=labels, y_pred=preds, average=average)
+            f1 = f1_score(y_true=labels, y_pred=preds, average=average)
+            if np.unique(labels).size > 1:
+                auc = roc_auc_score(labels, probs, average=average, multi_class="ovo")
+                mcc = matthews_corrcoef(labels, preds)
+            else:
+                auc = mcc = 0.0
+        results = {
             "acc": acc,
             "f1": f1,
             "mcc": mcc,
             "auc": auc,
-            "aupr": aupr,
-            "precision": precision,
-            "recall": recall,
         }
+        if include_aupr:
+            results["aupr"] = average_precision_score(labels, probs) if (labels == 1).any() else 0.0
+        results["precision"] = precision
+        results["recall"] = recall
+        return results
+
+    def acc_f1_mcc_auc_aupr_pre_rec(preds, labels, probs):
+        return _multiclass_or_binary_metrics(preds, labels, probs, average="binary", include_aupr=True)
 
     def acc_f1_mcc_auc_pre_rec(preds, labels, probs):
-        acc = simple_accuracy(preds, labels)
-        precision = precision_score(y_true=labels, y_pred=preds, average="macro")
-        recall = recall_score(y_true=labels, y_pred=preds, average="macro")
-        f1 = f1_score(y_true=labels, y_pred=preds, average="macro")
-        mcc = matthews_corrcoef(labels, preds)
-        auc = roc_auc_score(labels, probs, average="macro", multi_class="ovo")
-        return {
-            "acc": acc,
-            "f1": f1,
-            "mcc": mcc,
-            "auc": auc,
-            "precision": precision,
-            "recall": recall,
-        }
+        return _multiclass_or_binary_metrics(preds, labels, probs, average="macro", include_aupr=False)
 
     def pearson_and_spearman(preds, labels):
+        from scipy.stats import pearsonr, spearmanr
+
+        if _is_empty(preds):
+            return {k: 0.0 for k in ("pearson", "spearmanr", "corr")}
         pearson_corr = pearsonr(preds, labels)[0]
         spearman_corr = spearmanr(preds, labels)[0]
         return {
@@ -95,115 +156,134 @@ if _has_sklearn:
             "corr": (pearson_corr + spearman_corr) / 2,
         }
     
-    def acc_f1_mcc_auc_pre_rec_forMultiLabel(preds, labels, probs):
-        from collections import defaultdict
-        import math
-        
-        def self_acc_f1_pre_rec(y_true, y_pred):
-            num_batch = len(y_true)
-            num_labels = len(y_true[0])
-            confusion_matrix = [defaultdict(int) for i in range(num_labels)]
-            for i in range(num_batch):
-                for j in range(num_labels):
-                    if y_true[i][j] == 2 or y_true[i][j] == 3:
-                        # only evaluate if the original label is true, not overlapping is true
-                        # skip those positive samples generated by overlapping
+    @functools.lru_cache()
+    def _load_conf_nb():
+        # returns None when numba is missing or fails to import (e.g. a NumPy version mismatch)
+        try:
+            from numba import njit, prange
+        except ImportError:
+            return None
+
+        @njit(parallel=True, cache=True)
+        def _conf_nb(y_true, y_pred):
+            # one fused pass per label column, no (N, L) temporaries
+            num_labels = y_true.shape[1]
+            out = np.zeros((num_labels, 4), np.int64)
+            for j in prange(num_labels):
+                for i in range(y_true.shape[0]):
+                    v = y_true[i, j]
+                    if v >= 2:
                         continue
-                    if y_true[i][j] and y_pred[i][j]:
-                        confusion_matrix[j]["TP"] += 1
-                    elif y_true[i][j] and not y_pred[i][j]:
-                        confusion_matrix[j]["FN"] += 1
-                    elif not y_true[i][j] and y_pred[i][j]:
-                        confusion_matrix[j]["FP"] += 1
+                    p = y_pred[i, j] != 0
+                    if v == 1 and p:
+                        out[j, 0] += 1
+                    elif v == 1:
+                        out[j, 2] += 1
+                    elif p:
+                        out[j, 1] += 1
                     else:
-                        confusion_matrix[j]["TN"] += 1
-            ret = [None for i in range(num_labels)]
-            for i in range(num_labels):
-                TP = confusion_matrix[i]["TP"]
-                FP = confusion_matrix[i]["FP"]
-                TN = confusion_matrix[i]["TN"]
-                FN = confusion_matrix[i]["FN"]
-                #print(TP, FP, TN, FN)
-                print(i, TP, FP, FN, TN, TP+FP, TP+FN, TP+TN)
-                precision = TP / (TP + FP) if (TP + FP) != 0 else (1.0 if (TP + FN) == 0 else 0.0)
-                recall = TP / (TP + FN) if (TP + FN) != 0 else 1
-                f1 = 2 * precision * recall / (precision + recall) if not math.isclose(precision + recall, 0) else 0.0
-                accuracy = (TP + TN) / (TP + TN + FP + FN)
-                ret[i] = {
-                    "precision": precision,
-                    "recall": recall,
-                    "f1": f1,
-                    "accuracy": accuracy,
-                }
-            return ret
-
-        tmp = self_acc_f1_pre_rec(y_true=labels, y_pred=preds)
-        num_labels = len(preds[0])
-
-        ret = dict()
-        for i in range(num_labels):
-            # calculate auc
-            if i == 0:
-                labels_auc = np.array(labels)[:,i]
-                probs_auc = np.array(probs)[:,i]
+                        out[j, 3] += 1
+            return out
+
+        return _conf_nb
+
+    def acc_f1_mcc_auc_pre_rec_forMultiLabel(preds, labels, probs):
+        from sklearn.metrics import multilabel_confusion_matrix, roc_auc_score
+
+        labels = np.asarray(labels)
+        preds = np.asarray(preds)
+        probs = np.asarray(probs)
+        if _is_empty(preds):
+            num_labels = labels.shape[1] if labels.ndim == 2 else 0
+            keys = ("acc", "auc", "f1", "precision", "recall")
+            return {k: np.zeros(num_labels) for k in keys}, {k: 0.0 for k in keys}
+
+        def _conf(y_true, y_pred, valid):
+            # only evaluate if the original label is true, not overlapping is true
+            # skip those positive samples (label 2 or 3) generated by overlapping
+            # returns an int64 (num_labels, 4) array with columns TP, FP, FN, TN
+            num_labels = y_true.shape[1]
+            if valid.all():
+                counts = multilabel_confusion_matrix(y_true, y_pred).reshape(num_labels, 4)
             else:
-                labels_auc = []
-                probs_auc = []
-                for j in range(len(preds)):
-                    if labels[j][i] == 2 or labels[j][i] == 3:
-                        continue
-                    else:
-                        labels_auc.append(labels[j][i])
-                        probs_auc.append(probs[j][i])
-                labels_auc = np.array(labels_auc)
-                probs_auc = np.array(probs_auc)            
-            try:
-                #auc = roc_auc_score(labels_, probs_, average="macro", multi_class="ovo")
-                auc = roc_auc_score(labels_auc, probs_auc, average=None)
-            except:
-                #print(f"{i} label is not balanced!")
-                auc = 0.0
-
-            acc = tmp[i]["accuracy"]
-            f1 = tmp[i]["f1"]
-            precision = tmp[i]["precision"]
-            recall = tmp[i]["recall"]
-            ret[i] = {
-                "acc": acc,
-                "auc": auc,                
-                "f1": f1,
-                "precision": precision,
-                "recall": recall
-            }
-        ret[num_labels] = {
-            "acc" : sum([ret[i]["acc"] for i in range(1,num_labels)]) / (num_labels - 1),
-            "auc" : sum([ret[i]["auc"] for i in range(1, num_labels)]) / (num_labels - 1),
-            "f1": sum([ret[i]["f1"] for i in range(1, num_labels)]) / (num_labels - 1),
-            "precision" : sum([ret[i]["precision"] for i in range(1, num_labels)]) / (num_labels - 1),
-            "recall" : sum([ret[i]["recall"] for i in range(1, num_labels)]) / (num_labels - 1),
+                # every ignored label (>= 2) is clamped to 2 so labels and predictions fit
+                # in one byte per cell and each label keeps to its own 8 bincount slots
+                y_true = np.ascontiguousarray(np.clip(y_true, 0, 2), dtype=np.uint8)
+                y_pred = (y_pred != 0).view(np.uint8)
+                conf_nb = _load_conf_nb() if y_true.size >= _NUMBA_MIN_CELLS else None
+                if conf_nb is not None:
+                    return conf_nb(y_true, y_pred)
+                # pack each cell as 2 * label + pred: codes 0..3 are TN/FP/FN/TP, while
+                # the overlapping labels land in 4..5 and are dropped after a single bincount
+                code = (y_true << 1) | y_pred
+                code = code + 8 * np.arange(num_labels, dtype=np.int64)
+                counts = np.bincount(code.ravel(), minlength=8 * num_labels).reshape(num_labels, 8)
+            # both layouts store TN, FP, FN, TP in their first four columns
+            return counts[:, [3, 1, 2, 0]].astype(np.int64, copy=False)
+
+        def self_acc_f1_pre_rec(conf):
+            TP, FP, FN, TN = conf.T
+            with np.errstate(divide="ignore", invalid="ignore"):
+                precision = np.where(TP + FP != 0, TP / (TP + FP), np.where(TP + FN == 0, 1.0, 0.0))
+                recall = np.where(TP + FN != 0, TP / (TP + FN), 1.0)
+                f1 = np.where(~np.isclose(precision + recall, 0), 2 * precision * recall / (precision + recall), 0.0)
+                accuracy = np.where(conf.sum(axis=1) != 0, (TP + TN) / conf.sum(axis=1), 0.0)
+            return precision, recall, f1, accuracy
+
+        num_labels = labels.shape[1]
+        valid = labels < 2
+
+        conf = _conf(labels, preds, valid)
+        precision, recall, f1, acc = self_acc_f1_pre_rec(conf)
+
+        # auc is undefined (reported as 0.0) for labels whose evaluated samples hold a single class
+        auc = np.zeros(num_labels)
+        balanced = (conf[:, 0] + conf[:, 2] > 0) & (conf[:, 1] + conf[:, 3] > 0)
+        if balanced.sum() > 1 and (valid == valid[:, :1]).all():
+            # every label skips the same samples, so all AUCs come from one call
+            rows = valid[:, 0]
+            auc[balanced] = roc_auc_score(labels[rows][:, balanced], probs[rows][:, balanced], average=None)
+        else:
+            for i in np.flatnonzero(balanced):
+                # calculate auc, skipping the overlapping positives (label 2 or 3)
+                mask = valid[:, i]
+                auc[i] = roc_auc_score(labels[:, i][mask], probs[:, i][mask])
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for i in range(num_labels):
+                TP, FP, FN, TN = conf[i]
+                logger.debug("label %d TP=%d FP=%d FN=%d TN=%d", i, TP, FP, FN, TN)
+
+        ans = {
+            "acc": acc,
+            "auc": auc,
+            "f1": f1,
+            "precision": precision,
+            "recall": recall,
         }
-        ans = defaultdict(list)
-        for i in range(num_labels):
-            for k in ret[i]:
-                ans[k].append(ret[i][k])
-        for k in ans:
-            ans[k] = np.array(ans[k])
-        return ans, ret[num_labels] # average
+        # label 0 is left out of the average
+        means = np.stack(list(ans.values()))[:, 1:].mean(axis=1)
+        return ans, dict(zip(ans, means))
 
 
     def glue_compute_metrics(task_name, preds, labels, probs=None):
         assert len(preds) == len(labels)
+        preds = np.asarray(preds)
+        labels = np.asarray(labels)
+        probs = None if probs is None else np.asarray(probs)
         if task_name == "cola":
-            return {"mcc": matthews_corrcoef(labels, preds)}
+            from sklearn.metrics import matthews_corrcoef
+
+            return {"mcc": matthews_corrcoef(labels, preds) if not _is_empty(preds) else 0.0}
         elif task_name == "sst-2":
             return {"acc": simple_accuracy(preds, labels)}
         elif task_name in ["dna690", "dnapair"]:
-            return acc_f1_mcc_auc_aupr_pre_rec(preds, labels, probs)
+            return _multiclass_or_binary_metrics(preds, labels, probs, average="binary", include_aupr=True)
         elif task_name == "dnaprom" or task_name == "dnasingleenhancer":
-            return acc_f1_mcc_auc_pre_rec(preds, labels, probs)
+            return _multiclass_or_binary_metrics(preds, labels, probs, average="macro", include_aupr=False)
             # return {"acc": simple_accuracy(preds, labels)}
         elif task_name == "dnasplice":
-            return acc_f1_mcc_auc_pre_rec(preds, labels, probs)
+            return _multiclass_or_binary_metrics(preds, labels, probs, average="macro", include_aupr=False)
         elif task_name == "mrpc":
             return acc_and_f1(preds, labels)
         elif task_name == "sts-b":